@@ -8,16 +8,19 @@ slicker.slicker.make_fixes after it does all its other work.
 from __future__ import absolute_import
 
 import ast
-import difflib
+import collections
 import os
 import sys
 
-from fix_includes import fix_python_imports
-
 from . import util
 from . import khodemod
 
 
+# AST node types for import statements.  (The ast module never subclasses
+# these, so exact type-checks against them are safe.)
+_IMPORT_TYPES = (ast.Import, ast.ImportFrom)
+
+
 def remove_empty_files_suggestor(filename, body):
     """Suggestor to remove any empty files we leave behind.
 
@@ -30,25 +33,36 @@ def remove_empty_files_suggestor(filename, body):
         # Ignore __init__.py files.
         return
 
-    file_info = util.File(filename, body)
+    file_info = util.file_for_body(filename, body)
 
-    has_docstrings_comments_or_imports = '#' in body
+    # We only look for comments (the slow part, since it means scanning the
+    # whole body) once we know there are no docstrings or imports.
+    has_docstrings_or_imports = False
+    # Bind these locally; this loop runs over every statement of every file
+    # we touched.
+    expr_type, str_type, import_from_type = ast.Expr, ast.Str, ast.ImportFrom
+    import_types = _IMPORT_TYPES
     for stmt in file_info.tree.body:
-        if isinstance(stmt, ast.Expr) and isinstance(stmt.value, ast.Str):
+        stmt_type = type(stmt)
+        if stmt_type is expr_type:
+            if type(stmt.value) is not str_type:
+                # Some real code; we don't want to do anything.
+                return
             # A docstring.
-            has_docstrings_comments_or_imports = True
-        elif isinstance(stmt, ast.ImportFrom) and stmt.module == '__future__':
-            # A __future__ import, which won't force us to keep the file.
-            pass
-        elif isinstance(stmt, (ast.Import, ast.ImportFrom)):
+            has_docstrings_or_imports = True
+        elif stmt_type in import_types:
+            if (stmt_type is import_from_type
+                    and stmt.module == '__future__'):
+                # A __future__ import, which won't force us to keep the file.
+                continue
             # A non-__future__ import.
-            has_docstrings_comments_or_imports = True
+            has_docstrings_or_imports = True
         else:
             # Some real code; we don't want to do anything.
             return
 
     # If we've gotten here, there's no "real code".
-    if has_docstrings_comments_or_imports:
+    if has_docstrings_or_imports or '#' in body:
         yield khodemod.WarningInfo(
             filename, 0, "This file looks mostly empty; consider removing it.")
     else:
@@ -65,49 +79,117 @@ def remove_leading_whitespace_suggestor(filename, body):
                              0, whitespace_len)
 
 
-class _FakeOptions(object):
-    """A fake `options` object to pass in to fix_python_imports."""
-    def __init__(self, project_root):
-        self.safe_headers = True
-        self.root = project_root
+# A fake `options` object to pass in to fix_python_imports.
+_FakeOptions = collections.namedtuple('_FakeOptions', ['safe_headers', 'root'])
+
+
+def _common_affix_lengths(a, b):
+    """Return the lengths of the common prefix and suffix of a and b.
+
+    The two never overlap: their sum is at most min(len(a), len(b)).
+    """
+    prefix_len = len(os.path.commonprefix([a, b]))
+    max_suffix_len = min(len(a), len(b)) - prefix_len
+    suffix_len = 0
+    while (suffix_len < max_suffix_len
+           and a[-1 - suffix_len] == b[-1 - suffix_len]):
+        suffix_len += 1
+    return prefix_len, suffix_len
+
+
+# Cache for _sorted_body: a dict from (project_root, body) to the result.
+# We don't expect to see many bodies more than once, so we just clear it
+# when it gets big, rather than keeping track of which entries are old.
+_SORTED_BODY_CACHE = {}
+_SORTED_BODY_CACHE_SIZE = 256
+
+
+def _sorted_body(project_root, body):
+    """Return body with its imports sorted, or None if there is nothing to do.
+
+    Parsing and fixing the file is fairly slow, so the result is cached by
+    the body's contents.  (The result also depends on which modules exist
+    under project_root, which we assume doesn't change between the calls that
+    share a body.)
+    """
+    if 'import' not in body:
+        # fix_python_imports only ever touches import lines (and the blank
+        # lines and comments around them), so there's nothing to do.
+        return None
+    key = (project_root, body)
+    if key not in _SORTED_BODY_CACHE:
+        if len(_SORTED_BODY_CACHE) >= _SORTED_BODY_CACHE_SIZE:
+            _SORTED_BODY_CACHE.clear()
+        _SORTED_BODY_CACHE[key] = _compute_sorted_body(project_root, body)
+    return _SORTED_BODY_CACHE[key]
+
+
+def _compute_sorted_body(project_root, body):
+    """Does the work of _sorted_body, uncached."""
+    # fix_python_imports is slow to import, and we only need it if we
+    # actually have imports to sort, so we import it here.
+    from fix_includes import fix_python_imports
+
+    fix_imports_flags = _FakeOptions(safe_headers=True, root=project_root)
+    change_record = fix_python_imports.ChangeRecord('fake_file.py')
+
+    # A modified version of fix_python_imports.GetFixedFile
+    # NOTE: fix_python_imports needs the rootdir to be on the
+    # path so it can figure out third-party deps correctly.
+    # (That's in addition to having it be in FakeOptions, sigh.)
+    try:
+        sys.path.insert(0, os.path.abspath(project_root))
+        file_line_infos = fix_python_imports.ParseOneFile(
+            body, change_record)
+        fixed_lines = fix_python_imports.FixFileLines(
+            change_record, file_line_infos, fix_imports_flags)
+    finally:
+        del sys.path[0]
+
+    if fixed_lines is None:
+        return None
+    # Adding a final '' gives us the trailing newline (if there are any
+    # lines at all).
+    fixed_body = '\n'.join([line for line in fixed_lines
+                            if line is not None] + [''])
+    if '\r\n' in body and body.count('\n') == body.count('\r\n'):
+        # fix_python_imports splits on any newline, and we join with '\n',
+        # so for a file with windows newlines we have to put them back.
+        # (Otherwise we'd rewrite every line of the file, not just its
+        # imports.)  For mixed newlines, we don't try to be clever.
+        fixed_body = fixed_body.replace('\n', '\r\n')
+    if fixed_body == body:
+        return None
+    return fixed_body
 
 
 def import_sort_suggestor(project_root):
     """Suggestor to fix up imports in a file."""
-    fix_imports_flags = _FakeOptions(project_root)
-
     def suggestor(filename, body):
-        """`filename` relative to project_root."""
+        """`filename` relative to project_root.
+
+        We make at most one patch, so we just return a list of it rather than
+        being a generator.
+        """
         # TODO(benkraft): merge this with the import-adding, so we just show
         # one diff to add in the right place, unless there is additional
         # sorting to do.
         # Now call out to fix_python_imports to do the import-sorting
-        change_record = fix_python_imports.ChangeRecord('fake_file.py')
-
-        # A modified version of fix_python_imports.GetFixedFile
-        # NOTE: fix_python_imports needs the rootdir to be on the
-        # path so it can figure out third-party deps correctly.
-        # (That's in addition to having it be in FakeOptions, sigh.)
-        try:
-            sys.path.insert(0, os.path.abspath(project_root))
-            file_line_infos = fix_python_imports.ParseOneFile(
-                body, change_record)
-            fixed_lines = fix_python_imports.FixFileLines(
-                change_record, file_line_infos, fix_imports_flags)
-        finally:
-            del sys.path[0]
-
-        if fixed_lines is None:
-            return
-        fixed_body = ''.join(['%s\n' % line for line in fixed_lines
-                              if line is not None])
-        if fixed_body == body:
-            return
-
-        diffs = difflib.SequenceMatcher(None, body, fixed_body).get_opcodes()
-        for op, i1, i2, j1, j2 in diffs:
-            if op != 'equal':
-                yield khodemod.Patch(filename,
-                                     body[i1:i2], fixed_body[j1:j2], i1, i2)
+        fixed_body = _sorted_body(project_root, body)
+        if fixed_body is None:
+            return []
+
+        # fix_python_imports only rewrites whole lines, and usually only a
+        # few of them, so rather than diffing the bodies we just replace the
+        # lines between the common prefix and suffix with a single patch.
+        lines = body.splitlines(True)
+        new_lines = fixed_body.splitlines(True)
+        prefix_len, suffix_len = _common_affix_lengths(lines, new_lines)
+        start = sum(len(line) for line in lines[:prefix_len])
+        end = len(body) - sum(len(line)
+                              for line in lines[len(lines) - suffix_len:])
+        new_end = len(fixed_body) - (len(body) - end)
+        return [khodemod.Patch(filename, body[start:end],
+                               fixed_body[start:new_end], start, end)]
 
     return suggestor
@@ -10,12 +10,13 @@ TERMS:
     khodemod.  They're just functions (often curried -- that is, the actual
     suggestor is the function returned by calling some_suggestor(...))
     accepting a filename (string) and body (string, the text of that file) and
-    yielding a series of khodemod.Patch objects, representing the changes to be
-    made.  They may also yield khodemod.WarningInfo objects, which will be
-    displayed to the user as warnings, or raise khodemod.FatalError exceptions,
-    to refuse to process the given file.  Note that these changes will not be
-    applied until the suggestor completes operation.  For an example, see
-    regex_suggestor() below, which implements a simple find-and-replace.
+    yielding (or returning a list of) khodemod.Patch objects, representing the
+    changes to be made.  They may also yield khodemod.WarningInfo objects,
+    which will be displayed to the user as warnings, or raise
+    khodemod.FatalError exceptions, to refuse to process the given file.
+    Note that these changes will not be applied until the suggestor completes
+    operation.  For an example, see regex_suggestor() below, which implements
+    a simple find-and-replace.
 "frontend": These are responsible for applying the changes given by a
     suggestor, perhaps displaying output to the user (or even prompting for
     input) as they go.  Currently, only one is implemented,
@@ -36,7 +37,10 @@ TODO(benkraft): Implement a commandline interface for the regex suggestors.
 from __future__ import absolute_import
 
 import collections
+import itertools
+import multiprocessing
 import os
+import re
 
 import tqdm
 
@@ -48,6 +52,18 @@ DEFAULT_EXTENSIONS = ('py',)
 # Dict from (path-filter function, root) to the actual list of paths.
 _RESOLVE_PATHS_CACHE = {}
 
+# Dict from (root, filename) to (body, file_permissions) for writes which a
+# frontend is holding in memory until the end of a batch (see
+# Frontend.begin_batch).  read_file consults this so that reads see those
+# writes before they hit disk.  A body of None means we will delete the file.
+_PENDING_WRITES = {}
+
+# (frontend, suggestor, root) for the worker processes of a parallel
+# Frontend.run_suggestor_on_files.  We hand this to the workers by setting it
+# before forking them, since suggestors are typically closures, which can't
+# be pickled.
+_WORKER_STATE = None
+
 
 def regex_suggestor(regex, replacement):
     """Replaces regex (object) with replacement.
@@ -75,6 +91,9 @@ WarningInfo = collections.namedtuple('WarningInfo',
 
 
 class Patch(object):
+    # We make a lot of these, so we use slots to keep them small.
+    __slots__ = ('filename', 'old', 'new', 'start', 'end', 'permissions')
+
     def __init__(self, filename, old, new, start, end, file_permissions=None):
         """An object representing a change to make to a filename.
 
@@ -108,6 +127,42 @@ class Patch(object):
             return body[:self.start] + self.new + body[self.end:]
 
 
+def _apply_patches(body, patches):
+    """Apply the patches, which should be sorted by start, to body.
+
+    This is equivalent to calling apply_to for each patch, last first (so as
+    not to have to track changing offsets), and returns the new body.  But
+    that copies the whole body once per patch; if the patches don't overlap,
+    we instead build the new body in a single pass.
+    """
+    prev_end = 0
+    for patch in patches:
+        if patch.new is None or patch.start < prev_end:
+            # A deletion, or overlapping patches; these are rare, so we just
+            # apply the patches one at a time, which handles them correctly.
+            for patch in reversed(patches):
+                body = patch.apply_to(body)
+            return body
+        prev_end = patch.end
+
+    # Since the patches don't overlap, applying the later ones first wouldn't
+    # change the text the earlier ones see; so we can check them all against
+    # the original body (in the same order apply_to would).
+    for patch in reversed(patches):
+        if body[patch.start:patch.end] != (patch.old or ''):
+            raise FatalError(patch.filename, patch.start,
+                             "patch didn't apply: %s" % (patch,))
+
+    pieces = []
+    prev_end = 0
+    for patch in patches:
+        pieces.append(body[prev_end:patch.start])
+        pieces.append(patch.new)
+        prev_end = patch.end
+    pieces.append(body[prev_end:])
+    return ''.join(pieces)
+
+
 class FatalError(RuntimeError):
     """Something went horribly wrong; we should give up patching this file."""
     def __init__(self, filename, pos, message):
@@ -122,6 +177,12 @@ class FatalError(RuntimeError):
     def __unicode__(self):
         return "Fatal Error:%s:%s:%s" % (self.filename, self.pos, self.message)
 
+    def __reduce__(self):
+        # The default pickling for exceptions would call __init__ with the
+        # wrong arguments.  We need to pickle these to send them back from
+        # worker processes.
+        return (FatalError, (self.filename, self.pos, self.message))
+
     def __eq__(self, other):
         return (isinstance(other, FatalError) and
                 self.filename == other.filename and self.pos == other.pos and
@@ -157,8 +218,14 @@ def dotfiles_path_filter():
 
 
 def exclude_paths_filter(exclude_paths):
-    return lambda path: not any(part in exclude_paths
-                                for part in path.split(os.path.sep))
+    if not exclude_paths:
+        return lambda path: True
+    # We check every file and directory we walk, so rather than splitting
+    # each path, we match any excluded path component with a single regex.
+    sep = re.escape(os.path.sep)
+    regex = re.compile(r'(?:^|%s)(?:%s)(?:%s|$)' % (
+        sep, '|'.join(re.escape(p) for p in exclude_paths), sep))
+    return lambda path: not regex.search(path)
 
 
 def and_filters(filters):
@@ -181,6 +248,9 @@ def read_file(root, filename):
     filename is taken relative to root.
     """
     # TODO(benkraft): Cache contents.
+    pending_write = _PENDING_WRITES.get((root, filename))
+    if pending_write is not None:
+        return pending_write[0]
     try:
         with open(os.path.join(root, filename)) as f:
             from . import unicode_util
@@ -262,11 +332,42 @@ def line_col_to_pos(text, line, col):
         raise RuntimeError("Invalid line number %s!" % line)
 
 
+def _get_suggestions_in_worker(filename):
+    """Run in a worker process by Frontend.run_suggestor_on_files.
+
+    Returns the list of things the suggestor yielded, or the FatalError it
+    raised.
+    """
+    frontend, suggestor, root = _WORKER_STATE
+    try:
+        return frontend._get_suggestions(suggestor, filename, root)
+    except FatalError as e:
+        return e
+
+
 class Frontend(object):
-    def __init__(self):
+    def __init__(self, jobs=1):
+        """If jobs is more than 1, run suggestors in that many processes.
+
+        Only the suggestors themselves are run in parallel; patches are
+        still applied one file at a time in this process.  Since we compute
+        all the suggestions before applying any patches, this is only
+        correct for suggestors whose suggestions for one file don't depend on
+        the contents of others.  (This uses fork, so it needs a unix.)  If
+        jobs is 0, we use one process per CPU.
+        """
+        self.jobs = jobs or multiprocessing.cpu_count()
+        # See add_patch_listener.
+        self._patch_listeners = []
         # (root, filename) of files we've modified.
         # filename is relative to root.
         self._modified_files = set()
+        # Map from (root, filename) to the current body of files we've
+        # written, so that later passes over them needn't re-read them from
+        # disk.  None means we deleted the file.
+        self._written_bodies = {}
+        # Whether we are holding writes in memory; see begin_batch.
+        self._batching = False
 
     def handle_patches(self, root, filename, patches):
         """Accept a list of patches for a file, and apply them.
@@ -279,6 +380,15 @@ class Frontend(object):
         """
         raise NotImplementedError("Subclasses must override.")
 
+    def add_patch_listener(self, listener):
+        """Call listener(root, filename, patches) before we handle patches.
+
+        The arguments are as for handle_patches.  This is useful for keeping
+        track of what changes have been made; it's called in this process
+        even if suggestors are run in parallel.
+        """
+        self._patch_listeners.append(listener)
+
     def handle_warnings(self, root, filename, warnings):
         """Accept a list of warnings for a file, and tell the user.
 
@@ -292,6 +402,43 @@ class Frontend(object):
         """Accept a fatal error, and tell the user we'll skip this file."""
         raise NotImplementedError("Subclasses must override.")
 
+    def read_file(self, root, filename):
+        """Like khodemod.read_file, but knows about files we've written.
+
+        All our writes go through write_file, so its copy of the body is
+        up to date, and we can avoid going back to disk.
+        """
+        try:
+            return self._written_bodies[(root, filename)]
+        except KeyError:
+            return read_file(root, filename)
+
+    def begin_batch(self):
+        """Hold all writes in memory until commit_batch is called.
+
+        This is useful when several suggestors in a row will rewrite the
+        same few files: we write each of them to disk only once.  While
+        batching, read_file (both ours and khodemod.read_file) will see the
+        pending writes, but the filesystem itself won't, so suggestors run in
+        a batch shouldn't look at the disk directly (or use resolve_paths).
+        """
+        self._batching = True
+
+    def commit_batch(self):
+        """Write out everything held in memory since begin_batch."""
+        self._batching = False
+        pending_keys = sorted(key for key in _PENDING_WRITES
+                              if key in self._written_bodies)
+        for (root, filename) in pending_keys:
+            text, file_permissions = _PENDING_WRITES.pop((root, filename))
+            try:
+                self._write_file_to_disk(root, filename, text,
+                                         file_permissions)
+            except FatalError as e:
+                # We couldn't write it, so our copy is no good.
+                del self._written_bodies[(root, filename)]
+                self.handle_error(root, e)
+
     def write_file(self, root, filename, text, file_permissions=None):
         """filename is taken to be relative to root.
 
@@ -300,6 +447,18 @@ class Frontend(object):
 
         If file_permissions is not None, set the perms of filename.
         """
+        if self._batching:
+            _, old_permissions = _PENDING_WRITES.get(
+                (root, filename), (None, None))
+            _PENDING_WRITES[(root, filename)] = (
+                text, file_permissions or old_permissions)
+        else:
+            self._write_file_to_disk(root, filename, text, file_permissions)
+        if text is not None:
+            self._modified_files.add((root, filename))
+        self._written_bodies[(root, filename)] = text
+
+    def _write_file_to_disk(self, root, filename, text, file_permissions):
         abspath = os.path.abspath(os.path.join(root, filename))
         if text is None:    # it means we want to delete filename
             try:
@@ -322,7 +481,6 @@ class Frontend(object):
             with open(abspath, 'w') as f:
                 from . import unicode_util
                 f.write(unicode_util.encode(filename, text))
-                self._modified_files.add((root, filename))
             if file_permissions:
                 os.chmod(abspath, file_permissions)
 
@@ -333,12 +491,26 @@ class Frontend(object):
         """
         return paths
 
+    def _get_suggestions(self, suggestor, filename, root):
+        """Run the suggestor on the file; return a list of what it yields.
+
+        filename is relative to root.  May raise FatalError.
+        """
+        # Ensure the entire suggestor runs before we start patching.
+        return list(suggestor(filename, self.read_file(root, filename) or ''))
+
     def _run_suggestor_on_file(self, suggestor, filename, root):
         """filename is relative to root."""
         try:
-            # Ensure the entire suggestor runs before we start patching.
-            vals = list(
-                suggestor(filename, read_file(root, filename) or ''))
+            vals = self._get_suggestions(suggestor, filename, root)
+        except FatalError as e:
+            self.handle_error(root, e)
+        else:
+            self._handle_suggestions(vals, filename, root)
+
+    def _handle_suggestions(self, vals, filename, root):
+        """Apply what a suggestor yielded for filename (relative to root)."""
+        try:
             patches = [p for p in vals if isinstance(p, Patch)
                        and p.old != p.new]
             # HACK: consider addition-ish before deletion-ish.
@@ -367,6 +539,8 @@ class Frontend(object):
                     self.handle_warnings(root, filename,
                                          warnings_by_file[filename])
                 if filename in patches_by_file:
+                    for listener in self._patch_listeners:
+                        listener(root, filename, patches_by_file[filename])
                     self.handle_patches(root, filename,
                                         patches_by_file[filename])
         except FatalError as e:
@@ -374,8 +548,29 @@ class Frontend(object):
 
     def run_suggestor_on_files(self, suggestor, filenames, root='.'):
         """Like run_suggestor, but on exactly the given files."""
-        for filename in self.progress_bar(filenames):
-            self._run_suggestor_on_file(suggestor, filename, root)
+        if self.jobs > 1:
+            filenames = list(filenames)
+        if self.jobs <= 1 or len(filenames) <= 1:
+            for filename in self.progress_bar(filenames):
+                self._run_suggestor_on_file(suggestor, filename, root)
+            return
+
+        global _WORKER_STATE
+        _WORKER_STATE = (self, suggestor, root)
+        pool = multiprocessing.Pool(self.jobs)
+        try:
+            results = pool.imap(_get_suggestions_in_worker, filenames,
+                                chunksize=16)
+            for filename, vals in itertools.izip(
+                    self.progress_bar(filenames), results):
+                if isinstance(vals, FatalError):
+                    self.handle_error(root, vals)
+                else:
+                    self._handle_suggestions(vals, filename, root)
+        finally:
+            pool.terminate()
+            pool.join()
+            _WORKER_STATE = None
 
     def run_suggestor(self, suggestor,
                       path_filter=default_path_filter(), root='.'):
@@ -394,8 +589,9 @@ class Frontend(object):
         """
         for (root, filename) in self.progress_bar(self._modified_files):
             # If we modified a file by deleting it, no more
-            # suggestions for you!
-            if os.path.exists(os.path.join(root, filename)):
+            # suggestions for you!  (We wrote all these files, so we needn't
+            # go to disk to check.)
+            if self._written_bodies.get((root, filename)) is not None:
                 self._run_suggestor_on_file(suggestor, filename, root)
 
 
@@ -415,21 +611,18 @@ class AcceptingFrontend(Frontend):
         return paths
 
     def handle_patches(self, root, filename, patches):
-        body = read_file(root, filename)
-        # We operate in reverse order to avoid having to keep track of changing
-        # offsets.
-        new_body = body or ''
+        body = self.read_file(root, filename)
         new_file_perms = None
         for patch in reversed(patches):
             assert filename == patch.filename, patch
-            new_body = patch.apply_to(new_body)
             # The last-specified permission (due to reversed()) wins.
             new_file_perms = new_file_perms or patch.permissions
+        new_body = _apply_patches(body or '', patches)
         if body != new_body:
             self.write_file(root, filename, new_body, new_file_perms)
 
     def handle_warnings(self, root, filename, warnings):
-        body = read_file(root, filename) or ''
+        body = self.read_file(root, filename) or ''
         for warning in warnings:
             assert filename == warning.filename, warning
             lineno, _ = pos_to_line_col(body, warning.pos)
@@ -438,7 +631,7 @@ class AcceptingFrontend(Frontend):
                  % (warning.message, filename, lineno, line))
 
     def handle_error(self, root, error):
-        body = read_file(root, error.filename)
+        body = self.read_file(root, error.filename)
         if body:
             try:
                 lineno, _ = pos_to_line_col(body, error.pos)
@@ -27,17 +27,25 @@ class Import(object):
         node: the AST node for the import.  None for imports we will create.
         file_info: the util.FileInfo for the file in which the import resides
             (or will reside).
+        name_first_part, alias_first_part: the first dotted part of name and
+            alias, respectively.  (We look these up a lot.)
 
     So for example, 'from foo import bar' would result in an Import with
     name='foo.bar' and alias='bar'.  See test cases for more examples.  Note
     that for relative imports, 'name' will be the real, absolute name.
     """
+    # We make one of these for every import in every file we look at.
+    __slots__ = ('name', 'alias', 'name_first_part', 'alias_first_part',
+                 'relativity', 'node', '_file_info', '_span')
+
     def __init__(self, name, alias, relativity, node, file_info):
         # TODO(benkraft): Should relativity/node be optional?
         # TODO(benkraft): Perhaps this class should also own extracting
         # name/alias from node.
         self.name = name
         self.alias = alias
+        self.name_first_part = name.split('.', 1)[0]
+        self.alias_first_part = alias.split('.', 1)[0]
         self.relativity = relativity
         self.node = node
         self._file_info = file_info
@@ -139,11 +147,39 @@ def compute_all_imports(file_info, within_node=None, toplevel_only=False):
     if, functions, etc.  (We don't support setting both at once.)  Otherwise,
     look at the whole file.
 
-    Returns a set of Import objects.  We ignore __future__ imports.
+    Returns a tuple of Import objects (in no particular order, although it's
+    always the same for a given file).  We ignore __future__ imports.
+
+    The result is cached on the file_info, so repeated calls are cheap.
+    """
+    cache_key = (within_node, toplevel_only)
+    if cache_key not in file_info._imports:
+        file_info._imports[cache_key] = tuple(_compute_all_imports(
+            file_info, within_node, toplevel_only))
+    return file_info._imports[cache_key]
+
+
+def imports_by_alias_first_part(file_info):
+    """Return a dict from alias first part to the imports in the file.
+
+    This is cached on the file_info, like compute_all_imports.
     """
-    imports = set()
-    within_node = within_node or file_info.tree
-    nodes = within_node.body if toplevel_only else ast.walk(within_node)
+    if file_info._imports_by_alias_first_part is None:
+        index = {}
+        for imp in compute_all_imports(file_info):
+            index.setdefault(imp.alias_first_part, []).append(imp)
+        file_info._imports_by_alias_first_part = index
+    return file_info._imports_by_alias_first_part
+
+
+def _compute_all_imports(file_info, within_node, toplevel_only):
+    """Does the work of compute_all_imports, uncached."""
+    imports = []
+    if toplevel_only:
+        nodes = (within_node or file_info.tree).body
+    else:
+        nodes = file_info.nodes_of_types((ast.Import, ast.ImportFrom),
+                                         within_node)
     for node in nodes:
         if isinstance(node, ast.Import) or isinstance(node, ast.ImportFrom):
             if isinstance(node, ast.ImportFrom):
@@ -159,7 +195,7 @@ def compute_all_imports(file_info, within_node=None, toplevel_only=False):
                     relativity = 'explicit'
                     if node.module and relative_to:
                         # Covers "from .foo import bar"
-                        full_from = '%s.%s' % (relative_to, node.module)
+                        full_from = relative_to + '.' + node.module
                     else:
                         # Covers both "from . import bar" and the weird case
                         # "from ...sys import path" mentioned above.
@@ -173,11 +209,11 @@ def compute_all_imports(file_info, within_node=None, toplevel_only=False):
 
             for alias in node.names:
                 if full_from:
-                    name = '%s.%s' % (full_from, alias.name)
+                    name = full_from + '.' + alias.name
                 else:
                     name = alias.name
 
-                imports.add(
+                imports.append(
                     Import(name, alias.asname or alias.name,
                            relativity, node, file_info))
 
@@ -200,15 +236,32 @@ def _import_provides_module(imp, module):
         return True
     elif imp.alias == imp.name:
         # There is no from/as: we need to check for "implicit imports".
-        return imp.name.split('.', 1)[0] == module.split('.', 1)[0]
+        return imp.name_first_part == module.split('.', 1)[0]
     return False
 
 
+def _index_imports_by_name(imports):
+    """Index imports for localnames_from_fullnames.
+
+    Returns a pair of dicts: one from name to the imports of that name, and
+    one from the first part of a name to the unaliased imports of a name with
+    that first part.
+    """
+    imports_by_name = {}
+    unaliased_imports_by_name_prefix = {}
+    for imp in imports:
+        imports_by_name.setdefault(imp.name, []).append(imp)
+        if imp.name == imp.alias:
+            unaliased_imports_by_name_prefix.setdefault(
+                imp.name_first_part, []).append(imp)
+    return imports_by_name, unaliased_imports_by_name_prefix
+
+
 def localnames_from_fullnames(file_info, fullnames, imports=None):
     """Return LocalNames by which the fullnames may go in this file.
 
-    If passed, we use the imports from 'imports', which should be a set
-    of imports; otherwise we use all the imports from the file_info.
+    If passed, we use the imports from 'imports', which should be an
+    iterable of imports; otherwise we use all the imports from the file_info.
 
     Returns an iterable of LocalName namedtuples.
 
@@ -238,18 +291,18 @@ def localnames_from_fullnames(file_info, fullnames, imports=None):
        you'll get one return-value per late-import that you do.
     """
     if imports is None:
-        imports = compute_all_imports(file_info)
+        # We usually look at all the file's imports, often more than once,
+        # so we cache the index of them on the file_info.
+        if file_info._imports_by_name is None:
+            file_info._imports_by_name = _index_imports_by_name(
+                compute_all_imports(file_info))
+        imports_by_name, unaliased_imports_by_name_prefix = (
+            file_info._imports_by_name)
+    else:
+        imports_by_name, unaliased_imports_by_name_prefix = (
+            _index_imports_by_name(imports))
     current_module_name = util.module_name_for_filename(file_info.filename)
 
-    imports_by_name = {}
-    unaliased_imports_by_name_prefix = {}
-    for imp in imports:
-        name_prefix = imp.name.split('.', 1)[0]
-        imports_by_name.setdefault(imp.name, []).append(imp)
-        if imp.name == imp.alias:
-            unaliased_imports_by_name_prefix.setdefault(
-                name_prefix, []).append(imp)
-
     for fullname in fullnames:
         found_explicit_unaliased_import = False
         for fullname_prefix in util.dotted_prefixes(fullname):
@@ -288,8 +341,8 @@ def localnames_from_localnames(file_info, localnames, imports=None):
     corresponding to them.  (So for each input localname the corresponding
     output tuple(s) will have that localname as tuple.localname.)
 
-    If passed, we use the imports from 'imports', which should be a set
-    of imports; otherwise we use all the imports from the file_info.
+    If passed, we use the imports from 'imports', which should be an
+    iterable of imports; otherwise we use all the imports from the file_info.
 
     Returns an iterable of LocalName namedtuples.
 
@@ -340,9 +393,9 @@ def localnames_from_localnames(file_info, localnames, imports=None):
     imports_by_alias = {}
     imports_by_alias_prefix = {}
     for imp in imports:
-        alias_prefix = imp.alias.split('.', 1)[0]
         imports_by_alias.setdefault(imp.alias, []).append(imp)
-        imports_by_alias_prefix.setdefault(alias_prefix, []).append(imp)
+        imports_by_alias_prefix.setdefault(imp.alias_first_part, []).append(
+            imp)
 
     for localname in localnames:
         found_explicit_import = False
@@ -364,8 +417,9 @@ def localnames_from_localnames(file_info, localnames, imports=None):
         # If the name is a specific symbol defined in the file on which we are
         # operating, we also treat the unqualified reference as a localname,
         # with null import.
-        for toplevel_name in toplevel_names:
-            if util.dotted_starts_with(localname, toplevel_name):
-                yield LocalName('%s.%s' % (current_module_name, toplevel_name),
-                                toplevel_name, None)
-                break
+        # Toplevel names are never dotted, so only the first part of the
+        # localname can match one.
+        localname_first_part = localname.split('.', 1)[0]
+        if localname_first_part in toplevel_names:
+            yield LocalName(current_module_name + '.' + localname_first_part,
+                            localname_first_part, None)
@@ -78,7 +78,7 @@ def move_symbol_suggestor(project_root, old_fullname, new_fullname):
         if filename != util.filename_for_module_name(old_module):
             return
 
-        file_info = util.File(filename, body)
+        file_info = util.file_for_body(filename, body)
 
         # Find where old_fullname is defined in old_module.
         # TODO(csilvers): traverse try/except, for, etc, and complain
@@ -11,6 +11,7 @@ changes being made.)
 """
 from __future__ import absolute_import
 
+import re
 import tokenize
 
 from . import khodemod
@@ -18,6 +19,10 @@ from . import model
 from . import util
 
 
+# Comments that mark an import as deliberately unused.
+_NOLINT_RE = re.compile(r'@(?:nolint|unusedimport)', re.IGNORECASE)
+
+
 def _unused_imports(imports, old_fullname, file_info, within_node=None):
     """Decide what imports we can remove.
 
@@ -53,7 +58,7 @@ def _unused_imports(imports, old_fullname, file_info, within_node=None):
         # accessing via this import (special case (1) of the
         # module docstring, e.g. 'import foo.bar; foo.baz.myfunc()'.
         implicitly_used_names = util.names_starting_with(
-            imp.alias.split('.', 1)[0], within_node)
+            imp.alias_first_part, within_node, file_info)
         # This is only those names that we are explicitly accessing
         # via this import, i.e. not via such an "implicit import".
         explicitly_referenced_names = [
@@ -88,14 +93,15 @@ def _unused_imports(imports, old_fullname, file_info, within_node=None):
         all_imports = model.compute_all_imports(
             file_info, within_node=within_node)
 
-    kept_imports = all_imports - unused_imports - implicitly_used_imports
+    # A kept import gets us the same things as maybe_removable_imp if its
+    # alias starts with the same first part; so we just need to check those.
+    kept_alias_prefixes = {imp.alias_first_part for imp in all_imports
+                           if imp not in unused_imports
+                           and imp not in implicitly_used_imports}
     for maybe_removable_imp in list(implicitly_used_imports):
-        prefix = maybe_removable_imp.alias.split('.')[0]
-        for kept_imp in kept_imports:
-            if util.dotted_starts_with(kept_imp.alias, prefix):
-                implicitly_used_imports.remove(maybe_removable_imp)
-                unused_imports.add(maybe_removable_imp)
-                break
+        if maybe_removable_imp.alias_first_part in kept_alias_prefixes:
+            implicitly_used_imports.remove(maybe_removable_imp)
+            unused_imports.add(maybe_removable_imp)
 
     return (unused_imports, implicitly_used_imports)
 
@@ -106,19 +112,16 @@ def _remove_import_patch(imp, file_info):
     Returns a khodemod.Patch, or a khodemod.WarningInfo if we can't/won't
     remove the import.
     """
-    toks = list(file_info.tokens.get_tokens(imp.node, include_extra=False))
+    toks = file_info.tokens_for_node(imp.node)
     next_tok = file_info.tokens.next_token(toks[-1], include_extra=True)
-    if next_tok.type == tokenize.COMMENT and (
-            '@nolint' in next_tok.string.lower() or
-            '@unusedimport' in next_tok.string.lower()):
+    if (next_tok.type == tokenize.COMMENT and
+            _NOLINT_RE.search(next_tok.string)):
         # Don't touch nolinted imports; they may be there for a reason.
         # TODO(benkraft): Handle this case for implicit imports as well
         return khodemod.WarningInfo(
             file_info.filename, imp.start,
             "Not removing import with @Nolint.")
-    elif ',' in file_info.body[imp.start:imp.end]:
-        # TODO(benkraft): better would be to check for `,` in each
-        # token so we don't match commas in internal comments.
+    elif any(tok.type == tokenize.OP and tok.string == ',' for tok in toks):
         # TODO(benkraft): learn to handle this case.
         return khodemod.WarningInfo(
             file_info.filename, imp.start,
@@ -143,7 +146,7 @@ def remove_imports_suggestor(old_fullname):
             only remove imports that could have gotten us that symbol.)
     """
     def suggestor(filename, body):
-        file_info = util.File(filename, body)
+        file_info = util.file_for_body(filename, body)
 
         # First, set things up, and do some checks.
         # TODO(benkraft): Don't recompute these; _fix_uses_suggestor has
@@ -188,7 +191,7 @@ def remove_old_file_imports_suggestor(project_root, old_fullname):
         if util.module_name_for_filename(filename) != old_module:
             return
 
-        file_info = util.File(filename, body)
+        file_info = util.file_for_body(filename, body)
 
         # Remove toplevel imports in the old file that are no longer used.
         # Sadly, it's difficult to determine which ones might be at all related
@@ -230,7 +233,7 @@ def remove_moved_region_late_imports_suggestor(project_root, new_fullname):
         if util.module_name_for_filename(filename) != new_module:
             return
 
-        file_info = util.File(filename, body)
+        file_info = util.file_for_body(filename, body)
 
         # Find the region we moved.
         toplevel_names_in_new_file = util.toplevel_names(file_info)
@@ -245,9 +248,9 @@ def remove_moved_region_late_imports_suggestor(project_root, new_fullname):
         # This should probably just be imports of new_module, or things that
         # got us it, so we only look at those.
         unused_imports, implicitly_used_imports = _unused_imports(
-            {imp for imp in model.compute_all_imports(
+            [imp for imp in model.compute_all_imports(
                 file_info, within_node=moved_node)
-             if model._import_provides_module(imp, new_module)},
+             if model._import_provides_module(imp, new_module)],
             None, file_info, within_node=moved_node)
         for imp in implicitly_used_imports:
             yield khodemod.WarningInfo(
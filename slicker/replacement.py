@@ -7,6 +7,7 @@ entrypoint, replace_in_file, for more.
 from __future__ import absolute_import
 
 import ast
+import bisect
 import re
 import string
 import tokenize
@@ -20,6 +21,15 @@ _FILENAME_EXTENSIONS = ('.py', '.js', '.jsx', '.png', '.jpg', '.svg', '.html',
 _FILENAME_EXTENSIONS_RE_STRING = '|'.join(re.escape(e)
                                           for e in _FILENAME_EXTENSIONS)
 
+# Dicts from name (or path) to the compiled regex for it.  We look for the
+# same few names in every file, so it's worth not recompiling them each time.
+_RE_FOR_NAME_CACHE = {}
+_RE_FOR_PATH_CACHE = {}
+# Likewise, a dict from a tuple of patterns to the compiled regex combining
+# them; most files need the same combination.  (re has a cache of its own,
+# but it is small, and emptied entirely once it fills up.)
+_COMBINED_RE_CACHE = {}
+
 
 def _re_for_name(name):
     """Find a dotted-name (a.b.c) given that Python allows whitespace.
@@ -39,18 +49,27 @@ def _re_for_name(name):
     the entire string (which could be a mock or some other literal
     use).  We also allow surrounded-by-backticks, since that's
     markup-language for "code".
+
+    The regexes are cached, so this is cheap to call repeatedly.
     """
+    regex = _RE_FOR_NAME_CACHE.get(name)
+    if regex is not None:
+        return regex
+
     # TODO(csilvers): replace '\s*' by '\s*#\s*' below, and then we
     # can use this to match line-broken dotted-names inside comments too!
     name_with_spaces = re.escape(name).replace(r'\.', r'\s*\.\s*')
     if not name.strip(string.ascii_letters):
         # Name is entirely alphabetic.
-        return re.compile(r'(?<!\.)\b%s(?=\.\w)(?!%s)|^%s$|(?<=`)%s(?=`)'
-                          % (name_with_spaces, _FILENAME_EXTENSIONS_RE_STRING,
-                             name_with_spaces, name_with_spaces))
+        regex = re.compile(r'(?<!\.)\b%s(?=\.\w)(?!%s)|^%s$|(?<=`)%s(?=`)'
+                           % (name_with_spaces, _FILENAME_EXTENSIONS_RE_STRING,
+                              name_with_spaces, name_with_spaces))
     else:
-        return re.compile(r'(?<!\.)\b%s\b(?!%s)'
-                          % (name_with_spaces, _FILENAME_EXTENSIONS_RE_STRING))
+        regex = re.compile(r'(?<!\.)\b%s\b(?!%s)'
+                           % (name_with_spaces,
+                              _FILENAME_EXTENSIONS_RE_STRING))
+    _RE_FOR_NAME_CACHE[name] = regex
+    return regex
 
 
 def _re_for_path(path):
@@ -58,11 +77,43 @@ def _re_for_path(path):
 
     Note we do not match supersets of the path, so if path is
     a/b/c.py we do not match d/a/b/c.py.
+
+    Like _re_for_name, the regexes are cached.
     """
-    return re.compile(r'(?<!/)\b%s\b' % re.escape(path))
+    regex = _RE_FOR_PATH_CACHE.get(path)
+    if regex is None:
+        regex = _RE_FOR_PATH_CACHE[path] = re.compile(
+            r'(?<!/)\b%s\b' % re.escape(path))
+    return regex
+
 
+def _combine_regexes(regexes_and_replacements):
+    """Combine several regexes into one, so we can search for all at once.
 
-def _replace_in_string(node, regex, replacement, file_info):
+    Arguments:
+        regexes_and_replacements: a list of (compiled regex, replacement)
+            pairs.  The regexes must not have groups of their own.
+
+    Returns (combined regex, dict of group name -> replacement): when the
+    combined regex matches, the replacement to use is
+    replacements[match.lastgroup].  Where several of the regexes could
+    match at the same place, the one listed first wins.
+
+    The combined regexes are cached, so this is cheap to call repeatedly.
+    """
+    patterns = tuple(regex.pattern for regex, _ in regexes_and_replacements)
+    replacements = {'g%s' % i: replacement
+                    for i, (_, replacement)
+                    in enumerate(regexes_and_replacements)}
+    combined_regex = _COMBINED_RE_CACHE.get(patterns)
+    if combined_regex is None:
+        combined_regex = _COMBINED_RE_CACHE[patterns] = re.compile(
+            '|'.join('(?P<g%s>%s)' % (i, pattern)
+                     for i, pattern in enumerate(patterns)))
+    return combined_regex, replacements
+
+
+def _replace_in_string(node, regex, replacements, file_info):
     """Given a list of tokens representing a string, do a regex-replace.
 
     This is a bit tricky for a few reasons.  First, there may be
@@ -76,9 +127,10 @@ def _replace_in_string(node, regex, replacement, file_info):
 
     Arguments:
         node: an ast.Str node
-        regex: a compiled regex object
-        replacement: a string to replace with (note we do not support \1-style
-            references)
+        regex: a compiled regex object, as returned by _combine_regexes
+        replacements: a dict of group name -> the string to replace matches
+            of that group with, as returned by _combine_regexes (note we do
+            not support \1-style references)
         file_info: the file to do the replacements in.
 
     Returns: a generator of khodemod.Patch objects.
@@ -87,8 +139,9 @@ def _replace_in_string(node, regex, replacement, file_info):
         # The regex didn't match at all; no need to do further work.
         return
 
-    str_tokens = file_info.tokens.get_tokens(node, include_extra=True)
-    str_tokens = [tok for tok in str_tokens if tok.type == tokenize.STRING]
+    str_tokens = [tok for tok in file_info.tokens_for_node(
+                      node, include_extra=True)
+                  if tok.type == tokenize.STRING]
     tokens_less_delims = []
     delims = []
     for token in str_tokens:
@@ -101,28 +154,40 @@ def _replace_in_string(node, regex, replacement, file_info):
     # Note that this still may have escapes in it; we just assume we can not
     # care (e.g. that identifiers are all ASCII)
     joined_unparsed_str = ''.join(tokens_less_delims)
+
+    # The offsets at which each token starts and ends in joined_unparsed_str,
+    # so we can binary-search for which token a match starts/ends in.
+    token_starts = []
+    token_ends = []
+    offset = 0
+    for tok in tokens_less_delims:
+        token_starts.append(offset)
+        offset += len(tok)
+        token_ends.append(offset)
+    # Usually the string is a single token, or at least all its tokens use
+    # the same delimiters; then we can skip all the token-matching below.
+    single_token = len(str_tokens) == 1
+    delims_all_match = len(set(delims)) == 1
+
     for match in regex.finditer(joined_unparsed_str):
         abs_start, abs_end = match.span()
+        replacement = replacements[match.lastgroup]
 
         # Now convert the start and end of the match from an absolute
         # position in the string to a (token, pos-in-token) pair.
-        start_within_token, end_within_token = abs_start, abs_end
-
         # Note:
         # 0 <= start_within_token < len(tokens_less_delims[start_token_index])
         # and 0 < end_within_token <= len(tokens_less_delims[end_token_index])
-        for i, tok in enumerate(tokens_less_delims):
-            if start_within_token < len(tok):
-                start_token_index = i
-                break
-            else:
-                start_within_token -= len(tok)
-        for i, tok in enumerate(tokens_less_delims):
-            if end_within_token <= len(tok):
-                end_token_index = i
-                break
-            else:
-                end_within_token -= len(tok)
+        # (This is why we use bisect_right for the start, but bisect_left for
+        # the end: we skip past empty tokens like '' in both cases.)
+        if single_token:
+            start_token_index = end_token_index = 0
+        else:
+            start_token_index = bisect.bisect_right(
+                token_starts, abs_start) - 1
+            end_token_index = bisect.bisect_left(token_ends, abs_end)
+        start_within_token = abs_start - token_starts[start_token_index]
+        end_within_token = abs_end - token_starts[end_token_index]
 
         # Figure out what changes to actually make, based on the tokens we
         # have.
@@ -139,7 +204,8 @@ def _replace_in_string(node, regex, replacement, file_info):
         # Though it's easy in the case we're deleting all of start_token
         # or all of end_token.
 
-        if delims[start_token_index] == delims[end_token_index]:
+        if (delims_all_match or
+                delims[start_token_index] == delims[end_token_index]):
             # Delimiters match, so we can just use the start-delimiter
             # from start_token and the end-delimiter from end_token.
             pass
@@ -189,16 +255,22 @@ def replace_in_file(file_info, old_fullname, old_localnames,
     used_localnames = set()
     node_to_fix = node_to_fix or file_info.tree
 
-    # First, fix up normal references in code.
+    # First, fix up normal references in code.  This loop runs once per
+    # reference, so we look up the attributes it needs just once.  (We don't
+    # bind file_info.tokens here: computing it is slow, and many files have
+    # no references at all.)
+    filename = file_info.filename
+    body = file_info.body
     for localname in old_localnames:
         for (name, ast_nodes) in (
-                util.names_starting_with(localname, node_to_fix).iteritems()):
+                util.names_starting_with(
+                    localname, node_to_fix, file_info).iteritems()):
             for node in ast_nodes:
                 start, end = file_info.tokens.get_text_range(node)
                 used_localnames.add(localname)
                 if localname != new_localname:
                     patches.append(khodemod.Patch(
-                        file_info.filename, file_info.body[start:end],
+                        filename, body[start:end],
                         new_localname + name[len(localname):],
                         start, end))
 
@@ -208,11 +280,14 @@ def replace_in_file(file_info, old_fullname, old_localnames,
     # fully-qualified references with fully-qualified references; references to
     # aliases get replaced with whatever we're using for the rest of the file.
     regexes_to_check = []
+    # The names (not paths) we have regexes for.
+    names_to_check = []
     # If we are just updating the localname, and not actually moving the symbol
     # -- which happens in _fix_moved_region_suggestor -- we don't need to
     # update references to the fullname, because it hasn't changed.
     if old_fullname != new_fullname:
         regexes_to_check.append((_re_for_name(old_fullname), new_fullname))
+        names_to_check.append(old_fullname)
         # Also check for the fullname being represented as a file.
         # In cases where the fullname is not a module (but is instead
         # module.symbol) this will typically be a noop.
@@ -229,35 +304,54 @@ def replace_in_file(file_info, old_fullname, old_localnames,
         # flags.flags, not plain 'flags', in this case.
         if not util.dotted_starts_with(old_fullname, localname):
             regexes_to_check.append((_re_for_name(localname), new_localname))
+            names_to_check.append(localname)
+
+    if not regexes_to_check:
+        return patches, used_localnames
+
+    # As an optimization, we first check whether the names we're looking for
+    # appear anywhere in the file.  Every match of one of our regexes (or of
+    # the path regex, whose last part is the fullname's) contains the last
+    # dotted part of one of them, so if none of those are in the body, we
+    # can skip walking the strings and comments entirely.  (Like
+    # _fix_uses_suggestor's similar check, this misses strings split in the
+    # middle of an identifier.)
+    needles = {name.rsplit('.', 1)[-1] for name in names_to_check}
+    if not any(needle in file_info.body for needle in needles):
+        return patches, used_localnames
+
+    # We search for all the regexes in a single pass.
+    regex, replacements = _combine_regexes(regexes_to_check)
 
     # Strings
-    for node in ast.walk(node_to_fix):
-        if isinstance(node, ast.Str):
-            # We compute str_tokens only if any of the regexes match
-            for regex, replacement in regexes_to_check:
-                patches.extend(
-                    _replace_in_string(node, regex, replacement, file_info))
+    # Most strings (and comments, below) don't mention any of the names, so
+    # we use the same substring check on each of them before trying the
+    # regex, which is much slower.
+    for node in file_info.nodes_of_types((ast.Str,), node_to_fix):
+        if any(needle in node.s for needle in needles):
+            # We compute str_tokens only if the regex matches
+            patches.extend(
+                _replace_in_string(node, regex, replacements, file_info))
 
     # Comments
     # HACK: to avoid touching file_info.tokens unnecessarily, which is slow, we
-    # first check to see if the regexes appear *anywhere* in the body.  If not,
-    # they certainly can't be in a comment!  So we skip the extra parsing.
-    for regex, replacement in regexes_to_check:
-        if regex.search(file_info.body):
-            break
-    else:
+    # first check to see if the regex appears *anywhere* in the body.  If not,
+    # it certainly can't be in a comment!  So we skip the extra parsing.
+    if not regex.search(file_info.body):
         return patches, used_localnames
 
-    for token in file_info.tokens.get_tokens(node_to_fix, include_extra=True):
-        if token.type == tokenize.COMMENT:
-            for regex, replacement in regexes_to_check:
-                # TODO(benkraft): Handle names broken across multiple lines
-                # of comments.
-                for match in regex.finditer(token.string):
-                    patches.append(khodemod.Patch(
-                        file_info.filename,
-                        match.group(0), replacement,
-                        token.startpos + match.start(),
-                        token.startpos + match.end()))
+    first_index = node_to_fix.first_token.index
+    last_index = node_to_fix.last_token.index
+    for token in file_info.comment_tokens:
+        if (first_index <= token.index <= last_index and
+                any(needle in token.string for needle in needles)):
+            # TODO(benkraft): Handle names broken across multiple lines
+            # of comments.
+            for match in regex.finditer(token.string):
+                patches.append(khodemod.Patch(
+                    file_info.filename,
+                    match.group(0), replacements[match.lastgroup],
+                    token.startpos + match.start(),
+                    token.startpos + match.end()))
 
     return patches, used_localnames
@@ -70,9 +70,9 @@ TERMINOLOGY USED INTERNALLY
 """
 from __future__ import absolute_import
 
-import argparse
 import ast
 import itertools
+import os
 import sys
 import tokenize
 
@@ -109,10 +109,16 @@ def _check_import_conflicts(file_info, old_fullname, added_name, is_alias):
     TODO(benkraft): Also check if there are names defined in the
     file that collide.
     """
-    imports = model.compute_all_imports(file_info)
-
-    # Ignore imports of old_fullname, those are going to be deleted.
-    imports = {imp for imp in imports if imp.name != old_fullname}
+    # Either way, a conflicting import's alias must have the same first part
+    # as added_name, so we only need to look at those; usually there are
+    # none, so we're done with a dict lookup.
+    # Also, ignore imports of old_fullname, those are going to be deleted.
+    imports_by_alias_first_part = model.imports_by_alias_first_part(file_info)
+    imports = [imp for imp in imports_by_alias_first_part.get(
+                   added_name.split('.', 1)[0], ())
+               if imp.name != old_fullname]
+    if not imports:
+        return []
 
     # TODO(csilvers): perhaps a more self-evident way to code this would
     # be: complain if there is any shared prefix between added_import.alias
@@ -123,8 +129,8 @@ def _check_import_conflicts(file_info, old_fullname, added_name, is_alias):
         # e.g. we're adding 'import foo.bar as baz' or 'from foo import baz'
         # and the existing code has 'import baz' or 'import baz.bang' or
         # 'from qux import baz' or 'import quux as baz'.
-        return {imp for imp in imports
-                if util.dotted_starts_with(imp.alias, added_name)}
+        return [imp for imp in imports
+                if util.dotted_starts_with(imp.alias, added_name)]
     else:
         # If we aren't importing with an alias, we're looking for
         # existing imports who are a prefix of us.
@@ -133,8 +139,8 @@ def _check_import_conflicts(file_info, old_fullname, added_name, is_alias):
         # TODO(csilvers): this is actually ok in the case we're going
         # to remove the 'import baz as foo'/'from baz import foo' because
         # the only client of that import is the symbol that we're moving.
-        return {imp for imp in imports
-                if util.dotted_starts_with(added_name, imp.alias)}
+        added_name_prefixes = frozenset(util.dotted_prefixes(added_name))
+        return [imp for imp in imports if imp.alias in added_name_prefixes]
 
 
 def _choose_best_localname(file_info, fullname, name_to_import, import_alias):
@@ -343,9 +349,16 @@ def _fix_uses_suggestor(old_fullname, new_fullname,
                        we do too; if it was relative, we do that too;
                        otherwise we use name_to_import.
     """
+    # Do the checks and setup that don't depend on the file once, up front.
+    assert util.dotted_starts_with(new_fullname, name_to_import), (
+        "%s isn't a valid name to import -- not a prefix of %s" % (
+            name_to_import, new_fullname))
+    old_last_part = old_fullname.rsplit('.', 1)[-1]
+    # An import is "explicit" if it's of a (dotted) prefix of old_fullname.
+    old_fullname_prefixes = frozenset(util.dotted_prefixes(old_fullname))
+
     def suggestor(filename, body):
         """filename is relative to the value of --root."""
-        old_last_part = old_fullname.rsplit('.', 1)[-1]
         if old_last_part not in body:
             # As an optimization, don't operate on files that definitely don't
             # mention the moved symbol at all.  (For many moves, that's most of
@@ -358,13 +371,9 @@ def _fix_uses_suggestor(old_fullname, new_fullname,
             # the middle of an identifier.  Those are hopefully rare.
             return
 
-        file_info = util.File(filename, body)
-
-        # First, set things up, and do some checks.
-        assert util.dotted_starts_with(new_fullname, name_to_import), (
-            "%s isn't a valid name to import -- not a prefix of %s" % (
-                name_to_import, new_fullname))
+        file_info = util.file_for_body(filename, body)
 
+        # First, set things up.
         old_localnames = list(  # so we can re-use it
             model.localnames_from_fullnames(file_info, {old_fullname}))
         old_localname_strings = {ln.localname for ln in old_localnames}
@@ -390,7 +399,7 @@ def _fix_uses_suggestor(old_fullname, new_fullname,
                 new_import.alias != new_import.name)
             if conflicting_imports:
                 raise khodemod.FatalError(
-                    file_info.filename, conflicting_imports.pop().start,
+                    file_info.filename, conflicting_imports[0].start,
                     "Your alias will conflict with imports in this file.")
 
             old_imports = {ln.imp for ln in old_localnames
@@ -402,12 +411,13 @@ def _fix_uses_suggestor(old_fullname, new_fullname,
             # inside the same function at the same place.  In fact, we
             # might be late-importing the same module in *several*
             # functions, and each one has to get replaced properly.
-            explicit_imports = {
+            # (old_imports is already deduplicated, so a list will do.)
+            explicit_imports = [
                 imp for imp in old_imports
                 # TODO(benkraft): This is too weak -- we should only
                 # call an import explicit if it is of the symbol's module
                 # (see special case (2) in module docstring).
-                if util.dotted_starts_with(old_fullname, imp.name)}
+                if imp.name in old_fullname_prefixes]
 
             if not explicit_imports:
                 # We need to add a totally new toplevel import, not
@@ -424,6 +434,7 @@ def _fix_uses_suggestor(old_fullname, new_fullname,
                 # outside the scope of the late import.  To handle this
                 # case, we'll need to do much more careful tracing of which
                 # imports exist in which scopes.
+                import_stmt = new_import.import_stmt()
                 for imp in explicit_imports:
                     # Copy the old import's context, such as opening indent
                     # and trailing newline.
@@ -437,14 +448,21 @@ def _fix_uses_suggestor(old_fullname, new_fullname,
                     post_context = body[imp.end:end]
                     # Now we can add the new import and have the same context
                     # as the import we are taking the place of!
-                    text_to_add = ''.join(
-                        [pre_context, new_import.import_stmt(), post_context])
+                    text_to_add = pre_context + import_stmt + post_context
                     yield khodemod.Patch(filename, '', text_to_add,
                                          start, start)
 
     return suggestor
 
 
+def _import_alias_length(localname):
+    """Sort key for LocalNames: the length of the import's alias.
+
+    Names defined in the file itself (with no import) sort first.
+    """
+    return -1 if localname.imp is None else len(localname.imp.alias)
+
+
 def _fix_moved_region_suggestor(project_root, old_fullname, new_fullname):
     """Suggestor to fix up all the references to symbols in the moved region.
 
@@ -477,9 +495,9 @@ def _fix_moved_region_suggestor(project_root, old_fullname, new_fullname):
         if util.module_name_for_filename(filename) != new_module:
             return
 
-        file_info = util.File(filename, body)
+        file_info = util.file_for_body(filename, body)
         old_filename = util.filename_for_module_name(old_module)
-        old_file_info = util.File(
+        old_file_info = util.file_for_body(
             old_filename,
             khodemod.read_file(project_root, old_filename) or '')
 
@@ -549,6 +567,9 @@ def _fix_moved_region_suggestor(project_root, old_fullname, new_fullname):
         # Now, we fix up each name in turn.  This is the part that follows
         # _fix_uses_suggestor fairly closely.
         imports_to_add = set()
+        # Many names to fix often share an import (e.g. several symbols from
+        # one module), so we only check each import for conflicts once.
+        checked_imports = set()
         for new_fullname_to_fix, old_localnames_to_fix in (
                 names_to_fix.iteritems()):
             old_localname_strings = {
@@ -558,8 +579,7 @@ def _fix_moved_region_suggestor(project_root, old_fullname, new_fullname):
             # from -- we choose the one with the shortest alias to minimize
             # line-wrapping.
             old_fullname_to_fix, _, imp = min(
-                old_localnames_to_fix,
-                key=lambda ln: -1 if ln.imp is None else len(ln.imp.alias))
+                old_localnames_to_fix, key=_import_alias_length)
 
             # Figure out by what name we'll refer to new_fullname_to_fix in the
             # new file.  _choose_best_localname does most of the work, but we
@@ -603,13 +623,17 @@ def _fix_moved_region_suggestor(project_root, old_fullname, new_fullname):
             # to removal.remove_moved_region_imports_suggestor.  Luckily, that
             # doesn't complicate things much here.
             if used_localnames and need_new_import:
-                conflicting_imports = _check_import_conflicts(
-                    file_info, old_fullname, import_alias or name_to_import,
-                    bool(import_alias))
-                if conflicting_imports:
-                    raise khodemod.FatalError(
-                        file_info.filename, conflicting_imports.pop().start,
-                        "Your alias will conflict with imports in this file.")
+                added_name = import_alias or name_to_import
+                if (added_name, bool(import_alias)) not in checked_imports:
+                    checked_imports.add((added_name, bool(import_alias)))
+                    conflicting_imports = _check_import_conflicts(
+                        file_info, old_fullname, added_name,
+                        bool(import_alias))
+                    if conflicting_imports:
+                        raise khodemod.FatalError(
+                            file_info.filename, conflicting_imports[0].start,
+                            "Your alias will conflict with imports in this "
+                            "file.")
 
                 if imp and (not imp.relativity == 'explicit' or
                             old_module.split('.')[:-imp.node.level] ==
@@ -645,8 +669,22 @@ def _fix_moved_region_suggestor(project_root, old_fullname, new_fullname):
     return suggestor
 
 
+def _import_change_tracker(filenames):
+    """A patch listener noting in `filenames` which files' imports we change.
+
+    We can't tell exactly which patches touch imports, so we just look for
+    patches which add or remove text mentioning 'import'.  A false positive
+    just means we sort a file that didn't need it.
+    """
+    def listener(root, filename, patches):
+        if any('import' in (patch.old or '') or 'import' in (patch.new or '')
+               for patch in patches):
+            filenames.add(filename)
+    return listener
+
+
 def make_fixes(old_fullnames, new_fullname, import_alias=None,
-               project_root='.', automove=True, verbose=False):
+               project_root='.', automove=True, verbose=False, jobs=1):
     """Do all the fixing necessary to move old_fullnames to new_fullname.
 
     Arguments: parallel to the commandline -- see there for details.
@@ -667,14 +705,18 @@ def make_fixes(old_fullnames, new_fullname, import_alias=None,
        (_fix_uses_suggestor and removal.remove_imports_suggestor).
     4) Clean up: remove the module(s) we moved things out of, if it is now
        empty (cleanup.remove_empty_files_suggestor), and resort imports in any
-       file we touched (cleanup.import_sort_suggestor).
+       file whose imports we touched (cleanup.import_sort_suggestor).
     """
     def log(msg):
         if verbose:
             print msg
 
     # TODO(benkraft): Support other khodemod frontends.
-    frontend = khodemod.AcceptingFrontend(verbose=verbose)
+    frontend = khodemod.AcceptingFrontend(verbose=verbose, jobs=jobs)
+    # Files whose imports we may have changed, and so need resorting.
+    import_changed_filenames = set()
+    frontend.add_patch_listener(
+        _import_change_tracker(import_changed_filenames))
 
     # Return a list of (old_fullname, new_fullname) pairs that we can rename.
     old_new_fullname_pairs = inputs.expand_and_normalize(
@@ -683,39 +725,46 @@ def make_fixes(old_fullnames, new_fullname, import_alias=None,
     for (oldname, newname, is_symbol) in old_new_fullname_pairs:
         if automove:
             log("===== Moving %s to %s =====" % (oldname, newname))
-            if is_symbol:
-                old_filename = util.filename_for_module_name(
-                    oldname.rsplit('.', 1)[0])
-                move_suggestor = moves.move_symbol_suggestor(
-                    project_root, oldname, newname)
-            else:
-                old_filename = util.filename_for_module_name(oldname)
-                move_suggestor = moves.move_module_suggestor(
-                    project_root, oldname, newname)
-            frontend.run_suggestor_on_files(move_suggestor, [old_filename],
-                                            root=project_root)
-            if is_symbol:
-                new_filename = util.filename_for_module_name(
-                    newname.rsplit('.', 1)[0])
-                fix_moved_region_suggestor = _fix_moved_region_suggestor(
-                    project_root, oldname, newname)
-                frontend.run_suggestor_on_files(
-                    fix_moved_region_suggestor, [new_filename],
-                    root=project_root)
-
-                remove_old_file_imports_suggestor = (
-                    removal.remove_old_file_imports_suggestor(
-                        project_root, oldname))
-                frontend.run_suggestor_on_files(
-                    remove_old_file_imports_suggestor, [old_filename],
-                    root=project_root)
-
-                remove_moved_region_late_imports_suggestor = (
-                    removal.remove_moved_region_late_imports_suggestor(
-                        project_root, newname))
+            # The steps of the move rewrite the same one or two files over
+            # and over, so we hold the writes in memory until the end.
+            frontend.begin_batch()
+            try:
+                if is_symbol:
+                    old_filename = util.filename_for_module_name(
+                        oldname.rsplit('.', 1)[0])
+                    move_suggestor = moves.move_symbol_suggestor(
+                        project_root, oldname, newname)
+                else:
+                    old_filename = util.filename_for_module_name(oldname)
+                    move_suggestor = moves.move_module_suggestor(
+                        project_root, oldname, newname)
                 frontend.run_suggestor_on_files(
-                    remove_moved_region_late_imports_suggestor, [new_filename],
-                    root=project_root)
+                    move_suggestor, [old_filename], root=project_root)
+                if is_symbol:
+                    new_filename = util.filename_for_module_name(
+                        newname.rsplit('.', 1)[0])
+                    fix_moved_region_suggestor = (
+                        _fix_moved_region_suggestor(
+                            project_root, oldname, newname))
+                    frontend.run_suggestor_on_files(
+                        fix_moved_region_suggestor, [new_filename],
+                        root=project_root)
+
+                    remove_old_file_imports_suggestor = (
+                        removal.remove_old_file_imports_suggestor(
+                            project_root, oldname))
+                    frontend.run_suggestor_on_files(
+                        remove_old_file_imports_suggestor, [old_filename],
+                        root=project_root)
+
+                    remove_moved_region_late_imports_suggestor = (
+                        removal.remove_moved_region_late_imports_suggestor(
+                            project_root, newname))
+                    frontend.run_suggestor_on_files(
+                        remove_moved_region_late_imports_suggestor,
+                        [new_filename], root=project_root)
+            finally:
+                frontend.commit_batch()
 
         log("===== Updating references of %s to %s =====" % (oldname, newname))
         if is_symbol:
@@ -728,7 +777,8 @@ def make_fixes(old_fullnames, new_fullname, import_alias=None,
         frontend.run_suggestor(fix_uses_suggestor, root=project_root)
 
         remove_imports_suggestor = removal.remove_imports_suggestor(oldname)
-        frontend.run_suggestor_on_modified_files(remove_imports_suggestor)
+        frontend.run_suggestor_on_modified_files(
+            remove_imports_suggestor)
 
     log("===== Cleaning up empty files & whitespace =====")
     frontend.run_suggestor_on_modified_files(
@@ -738,12 +788,21 @@ def make_fixes(old_fullnames, new_fullname, import_alias=None,
 
     log("===== Resorting imports =====")
     import_sort_suggestor = cleanup.import_sort_suggestor(project_root)
-    frontend.run_suggestor_on_modified_files(import_sort_suggestor)
+    # Files we've since deleted don't need sorting.
+    frontend.run_suggestor_on_files(
+        import_sort_suggestor,
+        sorted(filename for filename in import_changed_filenames
+               if os.path.exists(os.path.join(project_root, filename))),
+        root=project_root)
 
     log("===== Move complete! =====")
 
 
 def main():
+    # Only the commandline needs argparse, so don't make importers of
+    # make_fixes pay to load it.
+    import argparse
+
     parser = argparse.ArgumentParser()
     parser.add_argument('old_fullnames', metavar='old_fullname', nargs='+',
                         help=('fullname to move: can be path.to.package, '
@@ -783,6 +842,10 @@ def main():
                               'and new_fullname are taken relative to root.'))
     parser.add_argument('-v', '--verbose', action='store_true',
                         help="Print some information about what we're doing.")
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help=('Number of processes to use when looking for '
+                              'references to update, or 0 to use one per '
+                              'CPU.  Default is %(default)s.'))
     parsed_args = parser.parse_args()
 
     if parsed_args.old_fullnames == ['-']:
@@ -800,7 +863,8 @@ def main():
         import_alias=alias,
         project_root=parsed_args.root,
         automove=parsed_args.automove,
-        verbose=parsed_args.verbose)
+        verbose=parsed_args.verbose,
+        jobs=parsed_args.jobs)
 
 
 if __name__ == '__main__':
@@ -22,16 +22,34 @@ def module_name_for_filename(filename):
 
 
 class File(object):
-    """Represents information about a file.
-
-    TODO(benkraft): Also cache things like _compute_all_imports.
-    """
+    """Represents information about a file."""
     def __init__(self, filename, body):
         """filename is relative to the value of --root."""
         self.filename = filename
         self.body = body
         self._tree = None    # computed lazily
         self._tokens = None  # computed lazily
+        self._comment_tokens = None  # computed lazily
+        # Cache for nodes_of_types: a dict from AST node to a dict from AST
+        # node type to all such nodes within that node.
+        self._nodes_by_type = {}
+        # Cache for model.compute_all_imports: a dict from its
+        # (within_node, toplevel_only) arguments to its result.
+        self._imports = {}
+        # Cache for model.localnames_from_fullnames: the indexes of the
+        # file's imports it uses.
+        self._imports_by_name = None
+        # Cache for model.imports_by_alias_first_part: a dict from the first
+        # dotted part of an import's alias to all such imports.
+        self._imports_by_alias_first_part = None
+        # Cache for names_starting_with: a dict from AST node to a dict from
+        # the first dotted part of each name within it to [(name, node)].
+        self._names_by_first_part = {}
+        # Cache for tokens_for_node: a dict from (node, include_extra) to
+        # the list of tokens.
+        self._tokens_for_node = {}
+        # Cache for toplevel_names.
+        self._toplevel_names = None
 
     @property
     def tree(self):
@@ -50,6 +68,37 @@ class File(object):
                                           "Couldn't parse this file: %s" % e)
         return self._tree
 
+    @property
+    def nodes_by_type(self):
+        """A dict of AST node type -> list of all such nodes in the file.
+
+        This lets the various things that look for particular kinds of nodes
+        in the whole file (imports, strings, names) share a single walk of
+        the tree.  Computed lazily on first use.
+        """
+        return self._nodes_by_type_within(self.tree)
+
+    def _nodes_by_type_within(self, within_node):
+        """Like nodes_by_type, but only for nodes within within_node."""
+        nodes_by_type = self._nodes_by_type.get(within_node)
+        if nodes_by_type is None:
+            nodes_by_type = self._nodes_by_type[within_node] = {}
+            for node in ast.walk(within_node):
+                nodes_by_type.setdefault(type(node), []).append(node)
+        return nodes_by_type
+
+    def nodes_of_types(self, node_types, within_node=None):
+        """All nodes of the given types within the node (default: the file).
+
+        node_types should be a tuple of AST node classes.  (We look them up
+        by exact type, which is fine since the ast module never subclasses
+        its node types.)  Like nodes_by_type, this shares a single walk of
+        each node between calls.
+        """
+        nodes_by_type = self._nodes_by_type_within(within_node or self.tree)
+        return [node for node_type in node_types
+                for node in nodes_by_type.get(node_type, ())]
+
     @property
     def tokens(self):
         """The asttokens.ASTTokens mapping for the file.
@@ -62,10 +111,57 @@ class File(object):
             self._tokens = asttokens.ASTTokens(self.body, tree=self.tree)
         return self._tokens
 
+    @property
+    def comment_tokens(self):
+        """All the COMMENT tokens in the file.  Computed lazily on first use.
+
+        Like tokens, this is somewhat slow to compute.
+        """
+        if self._comment_tokens is None:
+            self._comment_tokens = [tok for tok in self.tokens.tokens
+                                    if tok.type == tokenize.COMMENT]
+        return self._comment_tokens
+
+    def tokens_for_node(self, node, include_extra=False):
+        """A list of the tokens making up the node, as from tokens.get_tokens.
+
+        The result is cached, since we often look at the same node more than
+        once, e.g. for each name imported by a single import statement.
+        """
+        key = (node, include_extra)
+        if key not in self._tokens_for_node:
+            self._tokens_for_node[key] = list(
+                self.tokens.get_tokens(node, include_extra=include_extra))
+        return self._tokens_for_node[key]
+
     def __repr__(self):
         return "File(filename=%r)" % self.filename
 
 
+# Cache for file_for_body: a dict from (filename, body) to File.  The same
+# file is often parsed by several suggestors in a row, and parsing (and
+# especially tokenizing) is slow.  But File objects are big, so we don't
+# keep too many; like cleanup's cache, we just clear it when it's full.
+_FILE_CACHE = {}
+_FILE_CACHE_SIZE = 32
+
+
+def file_for_body(filename, body):
+    """Return a File for the given filename and body, perhaps a cached one.
+
+    Since the key includes the body, we never return a File for stale
+    contents.  Callers must treat the File as read-only, since it may be
+    shared.
+    """
+    key = (filename, body)
+    file_info = _FILE_CACHE.get(key)
+    if file_info is None:
+        if len(_FILE_CACHE) >= _FILE_CACHE_SIZE:
+            _FILE_CACHE.clear()
+        file_info = _FILE_CACHE[key] = File(filename, body)
+    return file_info
+
+
 def is_newline(token):
     # I think this is equivalent to doing
     #      token.type in (tokenize.NEWLINE, tokenize.NL)
@@ -83,13 +179,16 @@ def get_area_for_ast_node(node, file_info, include_previous_comments):
     If include_previous_comments is True, we also include all comments
     and newlines that directly precede the given node.
     """
-    toks = list(file_info.tokens.get_tokens(node, include_extra=True))
-    first_tok = toks[0]
-    last_tok = toks[-1]
+    # We work directly with token indexes, rather than listing out all the
+    # tokens of the node (or the rest of the file), which may be many.
+    # (Note that accessing file_info.tokens is what sets node.first_token.)
+    all_toks = file_info.tokens.tokens
+    first_tok = node.first_token
+    last_tok = node.last_token
 
     if include_previous_comments:
         for istart in xrange(first_tok.index - 1, -1, -1):
-            tok = file_info.tokens.tokens[istart]
+            tok = all_toks[istart]
             if (tok.string and not tok.type == tokenize.COMMENT
                     and not tok.string.isspace()):
                 break
@@ -97,7 +196,7 @@ def get_area_for_ast_node(node, file_info, include_previous_comments):
             istart = -1
     else:
         for istart in xrange(first_tok.index - 1, -1, -1):
-            tok = file_info.tokens.tokens[istart]
+            tok = all_toks[istart]
             if tok.string and (is_newline(tok) or not tok.string.isspace()):
                 break
         else:
@@ -105,14 +204,14 @@ def get_area_for_ast_node(node, file_info, include_previous_comments):
 
     # We don't want the *very* earliest newline before us to be
     # part of our context: it's ending the previous statement.
-    if istart >= 0 and is_newline(file_info.tokens.tokens[istart + 1]):
+    if istart >= 0 and is_newline(all_toks[istart + 1]):
         istart += 1
 
-    prev_tok_endpos = (file_info.tokens.tokens[istart].endpos
-                       if istart >= 0 else 0)
+    prev_tok_endpos = all_toks[istart].endpos if istart >= 0 else 0
 
     # Figure out how much of the last line to keep.
-    for tok in file_info.tokens.tokens[last_tok.index + 1:]:
+    for iend in xrange(last_tok.index + 1, len(all_toks)):
+        tok = all_toks[iend]
         if tok.type == tokenize.COMMENT:
             last_tok = tok
         elif is_newline(tok):
@@ -128,7 +227,15 @@ def toplevel_names(file_info):
     """Return a dict of name -> AST node with toplevel definitions in the file.
 
     This includes function definitions, class definitions, and constants.
+    The result is cached on the file_info; callers shouldn't modify it.
     """
+    if file_info._toplevel_names is None:
+        file_info._toplevel_names = _compute_toplevel_names(file_info)
+    return file_info._toplevel_names
+
+
+def _compute_toplevel_names(file_info):
+    """Does the work of toplevel_names, uncached."""
     # TODO(csilvers): traverse try/except, for, etc, and complain
     # if we see the symbol defined inside there.
     # TODO(benkraft): Figure out how to handle ast.AugAssign (+=) and multiple
@@ -150,7 +257,9 @@ def dotted_starts_with(string, prefix):
 
     That is, abc is a prefix of abc.de but not abcde.ghi.
     """
-    return prefix == string or string.startswith('%s.' % prefix)
+    # This is called a lot, so we avoid building the string prefix + '.'.
+    return string.startswith(prefix) and (
+        len(string) == len(prefix) or string[len(prefix)] == '.')
 
 
 def dotted_prefixes(string, proper_only=False):
@@ -161,9 +270,14 @@ def dotted_prefixes(string, proper_only=False):
 
     If proper_prefixes is True, do not include string itself.
     """
-    string_parts = string.split('.')
-    for i in xrange(len(string_parts) - (1 if proper_only else 0)):
-        yield '.'.join(string_parts[:i + 1])
+    # Rather than re-joining the parts for each prefix, we just find each
+    # dot and slice up to it.
+    dot_index = string.find('.')
+    while dot_index != -1:
+        yield string[:dot_index]
+        dot_index = string.find('.', dot_index + 1)
+    if not proper_only:
+        yield string
 
 
 def name_for_node(node):
@@ -174,12 +288,16 @@ def name_for_node(node):
     This only does anything interesting for Name and Attribute, and for
     Attribute only if it's like a.b.c, not (a + b).c.
     """
+    # We walk down the chain of attributes iteratively, and build the name
+    # all at once, to avoid making a string for each intermediate prefix.
+    attrs = []
+    while isinstance(node, ast.Attribute):
+        attrs.append(node.attr)
+        node = node.value
     if isinstance(node, ast.Name):
-        return node.id
-    elif isinstance(node, ast.Attribute):
-        value = name_for_node(node.value)
-        if value:
-            return '%s.%s' % (value, node.attr)
+        attrs.append(node.id)
+        attrs.reverse()
+        return '.'.join(attrs)
 
 
 def all_names(root):
@@ -191,28 +309,86 @@ def all_names(root):
     that, and only returns the "biggest" possible name -- if you reference
     a.b.c we won't include a.b.
 
-    Returns pairs (name, node)
+    Returns a list of pairs (name, node).  (We visit each node once, so
+    there are no duplicates; there's no need to pay to hash them into a set.)
     """
-    name = name_for_node(root)
-    if name:
-        return {(name, root)}
-    else:
-        return {(name, node)
-                for child in ast.iter_child_nodes(root)
-                for name, node in all_names(child)}
+    # We traverse with an explicit stack, rather than recursing, to avoid
+    # the overhead of python function calls and of merging sets.  Most nodes
+    # aren't names at all, so we check the type before calling name_for_node.
+    retval = []
+    nodes_to_visit = [root]
+    name_type = ast.Name
+    attribute_type = ast.Attribute
+    while nodes_to_visit:
+        node = nodes_to_visit.pop()
+        node_type = type(node)
+        if node_type is name_type or node_type is attribute_type:
+            name = name_for_node(node)
+            if name:
+                retval.append((name, node))
+                continue
+        nodes_to_visit.extend(ast.iter_child_nodes(node))
+    return retval
 
 
-def names_starting_with(prefix, ast_node):
+def _all_names_within(file_info, within_node):
+    """Like all_names(within_node), but using file_info.nodes_of_types.
+
+    within_node should be a node in file_info.  This lets us share the walk
+    of the tree with the other things that look at it.
+    """
+    named_nodes = []
+    for node in file_info.nodes_of_types((ast.Name, ast.Attribute),
+                                         within_node):
+        name = name_for_node(node)
+        if name:
+            named_nodes.append((name, node))
+    # We only want the "biggest" names: if a.b.c is a name, a.b and a are
+    # not.  Those are exactly the nodes which are the value of a named
+    # attribute.
+    inner_nodes = {node.value for _, node in named_nodes
+                   if isinstance(node, ast.Attribute)}
+    return [pair for pair in named_nodes if pair[1] not in inner_nodes]
+
+
+def _names_by_first_part(ast_node, file_info):
+    """Return all_names(ast_node), indexed by the first part of the name.
+
+    That is, returns a dict of first dotted part -> list of (name, node).
+    This is cached on file_info, since we often look up many names in the
+    same node.
+    """
+    names_index = file_info._names_by_first_part.get(ast_node)
+    if names_index is None:
+        names = _all_names_within(file_info, ast_node)
+        names_index = {}
+        for name, node in names:
+            names_index.setdefault(name.split('.', 1)[0], []).append(
+                (name, node))
+        file_info._names_by_first_part[ast_node] = names_index
+    return names_index
+
+
+def names_starting_with(prefix, ast_node, file_info=None):
     """Returns all dotted names in the given file beginning with 'prefix'.
 
     Does not include imports or string references or anything else funky like
     that.  "Beginning with prefix" in the dotted sense (see
     dotted_starts_with).
 
+    If file_info (the File containing ast_node) is passed, we use an index of
+    the names in ast_node cached on it, which is much faster if you're going
+    to look up several prefixes.
+
     Returns a dict of name -> list of AST nodes.
     """
+    if file_info is None:
+        candidates = all_names(ast_node)
+    else:
+        candidates = _names_by_first_part(ast_node, file_info).get(
+            prefix.split('.', 1)[0], ())
     retval = {}
-    for name, node in all_names(ast_node):
+    for name, node in candidates:
         if dotted_starts_with(name, prefix):
             retval.setdefault(name, []).append(node)
     return retval
@@ -1,7 +1,9 @@
 from __future__ import absolute_import
 
 import os
+import unittest
 
+from slicker import cleanup
 from slicker import slicker
 
 import base
@@ -147,3 +149,31 @@ class ImportSortTest(base.TestBase):
             expected = f.read()
         self.assertMultiLineEqual(expected, actual)
         self.assertFalse(self.error_output)
+
+
+class SortedBodyTest(base.TestBase):
+    def test_windows_newlines(self):
+        self.write_file('foo.py', 'def f(): pass\n')
+        self.write_file('zzz.py', 'x = 1\n')
+        self.assertEqual(
+            cleanup._sorted_body(
+                self.tmpdir, 'import zzz\r\nimport foo\r\n\r\nfoo.f()\r\n'),
+            'import foo\r\nimport zzz\r\n\r\nfoo.f()\r\n')
+
+
+class CommonAffixLengthsTest(unittest.TestCase):
+    def test_simple(self):
+        self.assertEqual(
+            cleanup._common_affix_lengths(
+                ['"""Doc."""\n', 'import foo\n', 'import bar\n', 'x = 1\n'],
+                ['"""Doc."""\n', 'import bar\n', 'import foo\n', 'x = 1\n']),
+            (1, 1))
+        self.assertEqual(cleanup._common_affix_lengths('abc', 'abc'), (3, 0))
+        self.assertEqual(cleanup._common_affix_lengths('', 'abc'), (0, 0))
+
+    def test_overlapping_affixes(self):
+        # 'aaa' is both a prefix and a suffix of 'aaaa', but the two lengths
+        # together shouldn't cover more than all of 'aaa'.
+        self.assertEqual(cleanup._common_affix_lengths('aaa', 'aaaa'), (3, 0))
+        self.assertEqual(cleanup._common_affix_lengths('abab', 'ab'), (2, 0))
+        self.assertEqual(cleanup._common_affix_lengths('axb', 'ayb'), (1, 1))
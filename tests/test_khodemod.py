@@ -1,5 +1,9 @@
 from __future__ import absolute_import
 
+import multiprocessing
+import re
+import unittest
+
 from slicker import khodemod
 
 import base
@@ -36,3 +40,123 @@ class PathFilterTest(base.TestBase):
                     extensions=('js', 'css'), include_extensionless=True),
                 root=self.tmpdir),
             ['foo_extensionless_py', 'foo.js', 'foo.css'])
+
+    def test_exclude_paths_filter(self):
+        path_filter = khodemod.exclude_paths_filter(('genfiles', 'build'))
+        self.assertFalse(path_filter('genfiles/qux.py'))
+        self.assertFalse(path_filter('foo/build/'))
+        self.assertFalse(path_filter('foo/genfiles'))
+        self.assertTrue(path_filter('genfiles_old/qux.py'))
+        self.assertTrue(path_filter('foo/mybuild/qux.py'))
+        self.assertTrue(khodemod.exclude_paths_filter(())('build/qux.py'))
+
+
+class ModifiedFilesTest(base.TestBase):
+    def test_uses_written_bodies(self):
+        self.write_file('foo.py', 'foo\n')
+        self.write_file('bar.py', 'bar\n')
+        frontend = khodemod.AcceptingFrontend()
+        frontend.run_suggestor_on_files(
+            khodemod.regex_suggestor(re.compile('o+'), 'u'),
+            ['foo.py', 'bar.py'], root=self.tmpdir)
+
+        seen = []
+
+        def suggestor(filename, body):
+            seen.append((filename, body))
+            return []
+
+        # Changes made behind the frontend's back aren't seen; the frontend
+        # owns the files it has written.
+        self.write_file('foo.py', 'something else\n')
+        frontend.run_suggestor_on_modified_files(suggestor)
+        self.assertEqual(seen, [('foo.py', 'fu\n')])
+
+    def test_skips_deleted_files(self):
+        self.write_file('foo.py', 'foo\n')
+        frontend = khodemod.AcceptingFrontend()
+        frontend.run_suggestor_on_files(
+            khodemod.regex_suggestor(re.compile('o+'), 'u'),
+            ['foo.py'], root=self.tmpdir)
+
+        def delete_suggestor(filename, body):
+            yield khodemod.Patch(filename, body, None, 0, len(body))
+        frontend.run_suggestor_on_modified_files(delete_suggestor)
+        self.assertFileIsNot('foo.py')
+
+        seen = []
+        frontend.run_suggestor_on_modified_files(
+            lambda filename, body: seen.append(filename) or [])
+        self.assertEqual(seen, [])
+
+    def test_batch(self):
+        self.write_file('foo.py', 'foo\n')
+        frontend = khodemod.AcceptingFrontend()
+        frontend.begin_batch()
+        frontend.run_suggestor_on_files(
+            khodemod.regex_suggestor(re.compile('o+'), 'u'),
+            ['foo.py'], root=self.tmpdir)
+        # Not on disk yet, but visible to reads.
+        self.assertFileIs('foo.py', 'foo\n')
+        self.assertEqual(khodemod.read_file(self.tmpdir, 'foo.py'), 'fu\n')
+        frontend.run_suggestor_on_files(
+            khodemod.regex_suggestor(re.compile('u'), 'ee'),
+            ['foo.py'], root=self.tmpdir)
+        frontend.commit_batch()
+        self.assertFileIs('foo.py', 'fee\n')
+        self.assertEqual(khodemod.read_file(self.tmpdir, 'foo.py'), 'fee\n')
+
+
+class ApplyPatchesTest(unittest.TestCase):
+    def test_simple(self):
+        body = 'import foo\n\nfoo.bar()\nfoo.baz()\n'
+        patches = [
+            khodemod.Patch('f.py', '', 'import qux\n', 0, 0),
+            khodemod.Patch('f.py', '', 'import quux\n', 0, 0),
+            khodemod.Patch('f.py', 'foo.bar', 'qux.bar', 12, 19),
+            khodemod.Patch('f.py', 'foo.baz', 'quux.baz', 22, 29),
+        ]
+        self.assertEqual(
+            khodemod._apply_patches(body, patches),
+            'import qux\nimport quux\nimport foo\n\nqux.bar()\nquux.baz()\n')
+
+    def test_overlapping(self):
+        # The second patch applies to the text left by the third.
+        patches = [
+            khodemod.Patch('f.py', 'a', 'x', 0, 1),
+            khodemod.Patch('f.py', 'by', 'z', 1, 3),
+            khodemod.Patch('f.py', 'c', 'y', 2, 3),
+        ]
+        self.assertEqual(khodemod._apply_patches('abc', patches), 'xz')
+
+    def test_bad_patch(self):
+        with self.assertRaises(khodemod.FatalError):
+            khodemod._apply_patches(
+                'abc', [khodemod.Patch('f.py', 'x', 'y', 1, 2)])
+
+
+def _error_on_bar_suggestor(filename, body):
+    if 'bar' in body:
+        raise khodemod.FatalError(filename, 0, "Found a bar!")
+    return khodemod.regex_suggestor(re.compile('o+'), 'u')(filename, body)
+
+
+class ParallelTest(base.TestBase):
+    def test_parallel(self):
+        for i in xrange(20):
+            self.write_file('foo%s.py' % i, 'foo = %s\n' % i)
+        self.write_file('bar.py', 'bar = "foo"\n')
+
+        frontend = khodemod.AcceptingFrontend(jobs=4)
+        frontend.run_suggestor(_error_on_bar_suggestor, root=self.tmpdir)
+
+        for i in xrange(20):
+            self.assertFileIs('foo%s.py' % i, 'fu = %s\n' % i)
+        self.assertFileIs('bar.py', 'bar = "foo"\n')
+        self.assertEqual(
+            self.error_output,
+            ['ERROR:Found a bar!\n    on bar.py:1 --> bar = "foo"'])
+
+    def test_jobs_per_cpu(self):
+        self.assertEqual(khodemod.AcceptingFrontend(jobs=0).jobs,
+                         multiprocessing.cpu_count())
@@ -105,6 +105,29 @@ class ComputeAllImportsTest(unittest.TestCase):
                 util.File('some_file.py',
                           'from __future__ import absolute_import\n')))
 
+    def test_cached(self):
+        file_info = util.File('some_file.py',
+                              'import foo\n'
+                              'def f():\n'
+                              '    import bar\n')
+        all_imports = model.compute_all_imports(file_info)
+        self.assertIs(model.compute_all_imports(file_info), all_imports)
+        toplevel_imports = model.compute_all_imports(
+            file_info, toplevel_only=True)
+        self.assertEqual({imp.name for imp in all_imports}, {'foo', 'bar'})
+        self.assertEqual({imp.name for imp in toplevel_imports}, {'foo'})
+
+    def test_by_alias_first_part(self):
+        file_info = util.File('some_file.py',
+                              'import foo.bar\n'
+                              'import baz as foo\n'
+                              'from qux import bar\n')
+        index = model.imports_by_alias_first_part(file_info)
+        self.assertIs(model.imports_by_alias_first_part(file_info), index)
+        self.assertEqual(
+            {key: {imp.name for imp in imps} for key, imps in index.items()},
+            {'foo': {'foo.bar', 'baz'}, 'bar': {'qux.bar'}})
+
 
 class LocalNamesFromFullNamesTest(unittest.TestCase):
     def _assert_localnames(self, actual, expected):
@@ -26,6 +26,42 @@ class RootTest(base.TestBase):
         self.assertMultiLineEqual(expected_body, actual_body)
         self.assertFalse(self.error_output)
 
+    def test_jobs(self):
+        self.copy_file('simple_in.py')
+        with open(self.join('foo.py'), 'w') as f:
+            print >>f, "def some_function(): return 4"
+
+        slicker.make_fixes(['foo.some_function'], 'bar.new_name',
+                           project_root=self.tmpdir, jobs=2)
+
+        with open(self.join('simple_in.py')) as f:
+            actual_body = f.read()
+        with open('testdata/simple_out.py') as f:
+            expected_body = f.read()
+        self.assertMultiLineEqual(expected_body, actual_body)
+        self.assertFalse(self.error_output)
+
+
+class ImportSortingTest(base.TestBase):
+    def test_only_sorts_files_with_changed_imports(self):
+        self.write_file('foo.py', 'def f(): pass\n')
+        self.write_file('zzz.py', 'x = 1\n')
+        # Only the reference in this file changes; its (unsorted) imports
+        # stay the same, so we shouldn't sort them.
+        self.write_file('uses_foo.py', ('import zzz\n'
+                                        'import foo\n\n'
+                                        'foo.f()\n'
+                                        'zzz.x\n'))
+
+        slicker.make_fixes(['foo.f'], 'foo.g', project_root=self.tmpdir,
+                           automove=False)
+
+        self.assertFileIs('uses_foo.py', ('import zzz\n'
+                                          'import foo\n\n'
+                                          'foo.g()\n'
+                                          'zzz.x\n'))
+        self.assertFalse(self.error_output)
+
 
 class FixUsesTest(base.TestBase):
     def run_test(self, filebase, old_fullname, new_fullname,
@@ -337,6 +373,16 @@ class FixUsesTest(base.TestBase):
             'repeated_name',
             'foo.foo', 'bar.foo.foo')
 
+    def test_comma_in_import_comment(self):
+        self.write_file('foo.py', 'def f(): pass\n')
+        self.write_file('uses_foo.py', ('from foo import (  # f, for now\n'
+                                        '    f)\n\n'
+                                        'f()\n'))
+        slicker.make_fixes(['foo.f'], 'bar.f', project_root=self.tmpdir)
+        self.assertFileIs('uses_foo.py', ('import bar\n\n'
+                                          'bar.f()\n'))
+        self.assertFalse(self.error_output)
+
 
 class AliasTest(base.TestBase):
     def assert_(self, old_module, new_module, alias,
@@ -32,6 +32,14 @@ class DottedPrefixTest(unittest.TestCase):
             util.dotted_prefixes('abc.def.ghi'),
             ['abc', 'abc.def', 'abc.def.ghi'])
 
+    def test_dotted_prefixes_proper_only(self):
+        self.assertEqual(
+            list(util.dotted_prefixes('abc', proper_only=True)),
+            [])
+        self.assertEqual(
+            list(util.dotted_prefixes('abc.def.ghi', proper_only=True)),
+            ['abc', 'abc.def'])
+
 
 class NamesStartingWithTest(unittest.TestCase):
     def test_simple(self):
@@ -77,3 +85,60 @@ class NamesStartingWithTest(unittest.TestCase):
                 '        return a.d(a.e + a.f)\n'
                 'abc(a.g)\n'))),
             {'a.b', 'a.c', 'a.d', 'a.e', 'a.f', 'a.g'})
+
+    def test_with_file_info(self):
+        file_info = util.File('some_file.py',
+                              'def abc():\n'
+                              '    if a.b == a.c:\n'
+                              '        return ab.d(a.e + abc.f)\n'
+                              'abc(a.g)\n')
+        self.assertEqual(
+            set(util.names_starting_with('a', file_info.tree, file_info)),
+            {'a.b', 'a.c', 'a.e', 'a.g'})
+        self.assertEqual(
+            set(util.names_starting_with('abc', file_info.tree, file_info)),
+            {'abc', 'abc.f'})
+        self.assertEqual(
+            set(util.names_starting_with('a.b', file_info.tree, file_info)),
+            {'a.b'})
+        self.assertEqual(
+            set(util.names_starting_with('d', file_info.tree, file_info)),
+            set())
+
+
+class FileTest(unittest.TestCase):
+    def test_tokens_for_node(self):
+        file_info = util.File('some_file.py',
+                              'import foo  # a comment\n'
+                              'x = "bar"\n')
+        import_node, assign_node = file_info.tree.body
+        toks = file_info.tokens_for_node(import_node)
+        self.assertEqual([tok.string for tok in toks], ['import', 'foo'])
+        self.assertIs(file_info.tokens_for_node(import_node), toks)
+        self.assertEqual(
+            [tok.string for tok in file_info.tokens_for_node(
+                assign_node.value, include_extra=True)],
+            ['"bar"'])
+        self.assertEqual([tok.string for tok in file_info.comment_tokens],
+                         ['# a comment'])
+
+    def test_file_for_body(self):
+        file_info = util.file_for_body('some_file.py', 'import foo\n')
+        self.assertIs(util.file_for_body('some_file.py', 'import foo\n'),
+                      file_info)
+        self.assertIsNot(util.file_for_body('some_file.py', 'import bar\n'),
+                         file_info)
+        self.assertIsNot(util.file_for_body('other_file.py', 'import foo\n'),
+                         file_info)
+
+    def test_toplevel_names(self):
+        file_info = util.File('some_file.py',
+                              'def f():\n'
+                              '    g = 1\n'
+                              'class C(object):\n'
+                              '    pass\n'
+                              'x = 1\n'
+                              'a, b = 1, 2\n')
+        toplevel = util.toplevel_names(file_info)
+        self.assertEqual(set(toplevel), {'f', 'C', 'x'})
+        self.assertIs(util.toplevel_names(file_info), toplevel)